@@ -1,2 +1,4 @@
 keylogger_service_url = "http://{HOST}:5002/keylogger"
-verify_uuid_change = "/{uuid}"
\ No newline at end of file
+verify_uuid_change = "/{uuid}"
+# Only enable once the server decompresses gzip request bodies
+compress_metrics = False
\ No newline at end of file
@@ -1,16 +1,26 @@
+import os
 import sys
-import json
+import gzip
 import re
 import time
+import queue
+import bisect
 import logging
 import threading
 import platform
-from datetime import datetime
+import ctypes
+from ctypes import wintypes
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 import subprocess
 import traceback
 import argparse
+from uuid import UUID
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pynput import keyboard
 from browser_history import get_history
 from win32gui import GetForegroundWindow, GetWindowText
@@ -19,17 +29,26 @@ import config
 
 logging.basicConfig(level=logging.INFO)
 
+LOG_FILE = "productivity_logs.json"
+COMPRESS_THRESHOLD = 1024  # Metrics bodies larger than this many bytes are sent gzip compressed
+VERIFY_INTERVAL = 3600  # Seconds between checks of the uuid -> employee mapping
+SMBIOS_PROVIDER = int.from_bytes(b"RSMB", "big")
+UUID_PATTERN = re.compile(r"[0-9A-Fa-f]{8}-(?:[0-9A-Fa-f]{4}-){3}[0-9A-Fa-f]{12}")
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--host", help="Host IP to which the stats to be sent")
-parser.add_argument("--interval", help="Interval to let the system know how frequent the stats has to be sent / persisted")
-parser.add_argument("--idletime", help="Threshold to calculate the idle time")
+parser.add_argument("--interval", type=int, help="Interval to let the system know how frequent the stats has to be sent / persisted")
+parser.add_argument("--idletime", type=int, help="Threshold to calculate the idle time")
+parser.add_argument("--pretty", action="store_true", help="Indent the persisted log file for debugging")
 
 class BrowserLogger:
     def __init__(self, unproductive_urls):
         self.unproductive_urls = unproductive_urls
         self.browser_time = {}  # Real-time tracking for the current day
         self.browser_history = {}  # Persistent history grouped by date
+        self._last_history_ts = None  # Newest history entry already counted
+        self._domain_cache = {}  # URL -> domain
 
     def fetch_browser_history(self):
         """
@@ -51,34 +70,42 @@ class BrowserLogger:
             history = self.fetch_browser_history()
             today = str(datetime.now().date())
 
-            # Initialize today's entry if not present
-            if today not in self.browser_time:
-                self.browser_time[today] = {}
-
-            for entry in history:
-                timestamp, url, title = entry
+            # Initialize today's entry if not present, locals avoid attribute lookups in the loop
+            browser_history = self.browser_history
+            today_time = self.browser_time.setdefault(today, {})
+            domain_cache = self._domain_cache
+            seen_ts = self._last_history_ts
+
+            last_history_ts = seen_ts
+            for timestamp, url, title in history:
+                # Entries up to the last run were counted already
+                if seen_ts is not None and timestamp <= seen_ts:
+                    continue
+                if last_history_ts is None or timestamp > last_history_ts:
+                    last_history_ts = timestamp
                 entry_date = str(timestamp.date())
 
-                # Group URLs by their date
-                if entry_date not in self.browser_history:
-                    self.browser_history[entry_date] = {}
-
-                domain = url.split('/')[2] if '//' in url else url
-
-                # Update history for the specific date
-                if domain not in self.browser_history[entry_date]:
-                    self.browser_history[entry_date][domain] = {"time_spent": 0, "visits": 0}
-
-                self.browser_history[entry_date][domain]["time_spent"] += 1  # Placeholder
-                self.browser_history[entry_date][domain]["visits"] += 1
-
-                # Update real-time tracking for today
+                domain = domain_cache.get(url)
+                if domain is None:
+                    if len(domain_cache) >= 10000:
+                        domain_cache.clear()
+                    try:
+                        domain = urlsplit(url).netloc or url
+                    except ValueError:
+                        # e.g. an unterminated IPv6 host, fall back to a plain split
+                        domain = url.split('/')[2] if '//' in url else url
+                    domain_cache[url] = domain
+
+                # Update history for the specific date, and real-time tracking when that date is today
+                history_entry = browser_history.setdefault(entry_date, {}).setdefault(domain, {"time_spent": 0, "visits": 0})
+                history_entry["time_spent"] += 1  # Placeholder
+                history_entry["visits"] += 1
                 if entry_date == today:
-                    if domain not in self.browser_time[today]:
-                        self.browser_time[today][domain] = {"time_spent": 0, "visits": 0}
-                    self.browser_time[today][domain]["time_spent"] += 1
-                    self.browser_time[today][domain]["visits"] += 1
+                    today_entry = today_time.setdefault(domain, {"time_spent": 0, "visits": 0})
+                    today_entry["time_spent"] += 1
+                    today_entry["visits"] += 1
 
+            self._last_history_ts = last_history_ts
             return self.browser_time
         except Exception as e:
             logging.error(f"Error logging browser activity: {e}")
@@ -87,8 +114,21 @@ class BrowserLogger:
 
 
 class ApplicationLogger:
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    EVENT_OBJECT_NAMECHANGE = 0x800C
+    WINEVENT_OUTOFCONTEXT = 0x0000
+    OBJID_WINDOW = 0
+    TITLE_SETTLE_SECONDS = 10  # A retitled window only counts as a new app once the title stays this long
+
     def __init__(self):
-        self.app_time = {}
+        self.app_time = {}  # Seconds spent per window
+        self._current_window = None
+        self._foreground_hwnd = None
+        self._last_change = time.monotonic()
+        self._pending_title = None  # (timestamp, title) of a title change that hasn't settled yet
+        self._lock = threading.Lock()
+        self._listeners = []  # Called with (timestamp, window) on every foreground change
+        self._win_event_proc = None  # Keep the ctypes callback referenced while the hook is installed
 
     @staticmethod
     def get_active_window():
@@ -98,9 +138,121 @@ class ApplicationLogger:
             logging.error(f"Error getting active window: {e}")
             return "Unknown"
 
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _switch_window_locked(self, window, at):
+        if window == self._current_window:
+            return None
+        at = max(at, self._last_change)
+        if self._current_window is not None:
+            self.app_time[self._current_window] = self.app_time.get(self._current_window, 0) + (at - self._last_change)
+        self._current_window = window
+        self._last_change = at
+        return at
+
+    def _on_window(self, window=None, title_change=False):
+        """
+        Record a foreground switch or title change. Title changes are held back until they settle, so
+        counters and progress in a title don't turn every variant into its own app.
+        """
+        now = time.monotonic()
+        switches = []
+        with self._lock:
+            if self._pending_title and now - self._pending_title[0] >= self.TITLE_SETTLE_SECONDS:
+                switches.append(self._pending_title)
+                self._pending_title = None
+            if window is not None:
+                if not title_change:
+                    self._pending_title = None
+                    switches.append((now, window))
+                elif window == self._current_window:
+                    self._pending_title = None
+                else:
+                    self._pending_title = (now, window)
+            # Notify under the lock so listeners see switches in timestamp order
+            for at, switch_window in switches:
+                at = self._switch_window_locked(switch_window, at)
+                if at is not None:
+                    for listener in self._listeners:
+                        listener(at, switch_window)
+
+    def track_foreground(self):
+        """
+        Follow the foreground window through WinEvent notifications instead of polling it.
+        """
+        user32 = ctypes.windll.user32
+        WinEventProc = ctypes.WINFUNCTYPE(
+            None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+            wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD
+        )
+
+        name_hook = None
+
+        def hook_title_changes(hwnd):
+            """
+            Scope the title hook to the thread owning the foreground window, so other windows' name changes
+            never reach this process.
+            """
+            nonlocal name_hook
+            if name_hook:
+                user32.UnhookWinEvent(name_hook)
+            process_id = wintypes.DWORD()
+            thread_id = user32.GetWindowThreadProcessId(hwnd, ctypes.byref(process_id))
+            name_hook = None
+            if thread_id:
+                name_hook = user32.SetWinEventHook(
+                    self.EVENT_OBJECT_NAMECHANGE, self.EVENT_OBJECT_NAMECHANGE, 0, self._win_event_proc,
+                    process_id.value, thread_id, self.WINEVENT_OUTOFCONTEXT
+                )
+
+        def on_event(hook, event, hwnd, id_object, id_child, event_thread, event_time):
+            try:
+                if event == self.EVENT_SYSTEM_FOREGROUND:
+                    self._foreground_hwnd = hwnd
+                    hook_title_changes(hwnd)
+                    self._on_window(GetWindowText(hwnd))
+                # Title changes only matter for the foreground window itself, not its child objects
+                elif id_object == self.OBJID_WINDOW and hwnd == self._foreground_hwnd:
+                    self._on_window(GetWindowText(hwnd), title_change=True)
+            except Exception as e:
+                logging.error(f"Error handling window event: {e}")
+
+        self._win_event_proc = WinEventProc(on_event)
+        self._foreground_hwnd = GetForegroundWindow()
+        self._on_window(self.get_active_window())
+
+        foreground_hook = user32.SetWinEventHook(
+            self.EVENT_SYSTEM_FOREGROUND, self.EVENT_SYSTEM_FOREGROUND, 0, self._win_event_proc, 0, 0, self.WINEVENT_OUTOFCONTEXT
+        )
+        if not foreground_hook:
+            logging.error("Error installing foreground window hook")
+        hook_title_changes(self._foreground_hwnd)
+
+        # Out of context hooks are delivered through this thread's message loop
+        msg = wintypes.MSG()
+        while user32.GetMessageW(ctypes.byref(msg), 0, 0, 0) > 0:
+            user32.TranslateMessage(ctypes.byref(msg))
+            user32.DispatchMessageW(ctypes.byref(msg))
+
+        for hook in (foreground_hook, name_hook):
+            if hook:
+                user32.UnhookWinEvent(hook)
+
+    def snapshot(self):
+        """
+        Copy of app_time taken under the lock, safe to iterate while the hook thread keeps updating it.
+        """
+        with self._lock:
+            return dict(self.app_time)
+
     def log_active_app(self):
-        active_window = self.get_active_window()
-        self.app_time[active_window] = self.app_time.get(active_window, 0) + 1
+        self._on_window()  # Apply a title change that has settled since the last event
+        now = time.monotonic()
+        with self._lock:
+            if self._current_window is not None:
+                self.app_time[self._current_window] = self.app_time.get(self._current_window, 0) + (now - self._last_change)
+            self._last_change = now
         return self.app_time
 
 
@@ -144,23 +296,61 @@ class IdleTimeLogger:
             logging.error(f"Error calculating idle time: {e}")
             return 0
 
+    @property
+    def idle(self):
+        return self.current_logged_time > 0
+
 
 class KeyboardLogger:
     def __init__(self, application_logger):
         self.key_data = {}  # To store keys per application or URL
         self.application_logger = application_logger
+        self.key_events = queue.SimpleQueue()  # (timestamp, key) pushed by the listener thread
+        self._window_timeline = []  # (timestamp, window) recorded whenever the foreground window changes
+        self._timeline_lock = threading.Lock()
+        self.application_logger.add_listener(self._on_window_change)
+
+    def _on_window_change(self, timestamp, window):
+        with self._timeline_lock:
+            self._window_timeline.append((timestamp, window))
+
+    def drain_key_events(self):
+        """
+        Move the queued key presses into key_data, bucketed by the window active when each key was pressed.
+        """
+        with self._timeline_lock:
+            timeline = list(self._window_timeline)
+        if not timeline:
+            return self.key_data
+        timestamps = [ts for ts, _ in timeline]
+
+        while True:
+            try:
+                ts, key_char = self.key_events.get_nowait()
+            except queue.Empty:
+                break
+            index = max(bisect.bisect_right(timestamps, ts) - 1, 0)
+            self.key_data.setdefault(timeline[index][1], []).append(key_char)
+
+        # Every queued key press is bucketed now, only the newest window can still receive keys
+        with self._timeline_lock:
+            del self._window_timeline[:len(timeline) - 1]
+        return self.key_data
+
+    def swap_key_data(self):
+        """
+        Hand over all buffered keys and start a fresh buffer.
+        """
+        key_data = self.drain_key_events()
+        self.key_data = {}
+        return key_data
 
     def track_keys(self):
         def on_press(key):
             try:
-                # Determine the active application
-                active_window = self.application_logger.get_active_window()
-                if active_window not in self.key_data:
-                    self.key_data[active_window] = []
-
-                # Record the key pressed
+                # Record the key pressed, the window is resolved when the queue is drained
                 key_char = key.char if hasattr(key, 'char') else str(key)
-                self.key_data[active_window].append(key_char)
+                self.key_events.put((time.monotonic(), key_char))
             except Exception as e:
                 logging.error(f"Error tracking key: {e}")
 
@@ -171,10 +361,20 @@ class KeyboardLogger:
 
 
 class ProductivityTracker:
-    def __init__(self, host="127.0.0.1", log_interval=300, idletime=300): # 5 mins once we log
+    def __init__(self, host="127.0.0.1", log_interval=300, idletime=300, pretty=False): # 5 mins once we log
         self.host = host
+        self.pretty = pretty  # Indent the log file, only useful when reading it by hand
         self._loaded = False
         self.log_interval = log_interval
+        self._today_cache = (0, None)  # (expiry timestamp, date string)
+        self._interval_multiplier = 1  # Spaces out history polling, aggregation and saves while idle or on battery
+        self._last_verify = None  # Monotonic time of the last user mapping check
+        self._send_q = queue.Queue(maxsize=32)  # Metrics payloads waiting to be posted
+        self._http = requests.Session()  # Keep-alive connection pool shared by all server calls
+        self._http.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=Retry(total=2, backoff_factor=0.5))
+        self._http.mount("http://", adapter)
+        self._http.mount("https://", adapter)
         self.uuid = self.get_system_uuid()
         self.unproductive_urls = ["facebook.com", "youtube.com", "instagram.com", "reddit.com"]
         self.browser_logger = BrowserLogger(self.unproductive_urls)
@@ -205,34 +405,80 @@ class ProductivityTracker:
     def get_windows_mac():
         import subprocess
 
+    @staticmethod
+    def read_smbios_uuid():
+        """
+        Read the system UUID straight from the SMBIOS system information table (the same value WMIC reports).
+        """
+        kernel32 = ctypes.windll.kernel32
+        size = kernel32.GetSystemFirmwareTable(SMBIOS_PROVIDER, 0, None, 0)
+        if not size:
+            return None
+        buffer = ctypes.create_string_buffer(size)
+        if kernel32.GetSystemFirmwareTable(SMBIOS_PROVIDER, 0, buffer, size) != size:
+            return None
+        data = buffer.raw
+
+        # RawSMBIOSData header: calling method, major, minor, DMI revision, table length
+        major, minor = data[1], data[2]
+        table_end = 8 + int.from_bytes(data[4:8], "little")
+        offset = 8
+        while offset + 4 <= table_end:
+            struct_type, struct_length = data[offset], data[offset + 1]
+            if struct_type == 1 and struct_length >= 0x19:
+                raw = data[offset + 8:offset + 24]
+                if raw in (b"\x00" * 16, b"\xff" * 16):
+                    return None
+                # Before SMBIOS 2.6 the byte order was ambiguous, leave those to WMIC so the value can't change
+                if (major, minor) < (2, 6):
+                    return None
+                return str(UUID(bytes_le=raw)).upper()
+            if struct_type == 127:
+                break
+            # Skip the formatted area and the string-set, which ends with a double NUL
+            offset = data.find(b"\x00\x00", offset + struct_length)
+            if offset < 0:
+                break
+            offset += 2
+        return None
+
     def get_system_uuid(self):
         try:
-            pattern = r"(([\da-zA-z]+\-)+([\da-zA-z])+)"
+            uuid = self.read_smbios_uuid()
+            if uuid:
+                return uuid
+        except Exception as e:
+            logging.warning(f"Error reading SMBIOS UUID, falling back to WMIC: {e}")
+        try:
             # Use WMIC command to get the UUID
             output = subprocess.check_output(
                 "wmic csproduct get uuid", shell=True, universal_newlines=True
             )
-            uuid = re.search(pattern, output).groups()[0]  # Extract the UUID from the output
+            uuid = UUID_PATTERN.search(output).group(0)  # Extract the UUID from the output
             return uuid
         except Exception as e:
             raise e
 
     def load_logs(self):
         try:
-            with open("productivity_logs.json", "r", encoding="utf-8") as f:
-                if len(f.readlines()) > 10:
-                    f.seek(0)
-                    self.logs = json.load(f)
+            with open(LOG_FILE, "rb") as f:
+                if os.fstat(f.fileno()).st_size > 0:
+                    self.logs = orjson.loads(f.read())
                     self.loaded = True
+                    # Drop raw keys recorded by older versions, only the counts are kept now
+                    for day_log in self.logs["day_logs"].values():
+                        for activities in (day_log.get("browser_activity", {}), day_log.get("application_activity", {})):
+                            for activity in activities.values():
+                                activity.pop("keys", None)
                 else:
                     self.logs = {"emp_id": -1, "day_logs": {}, "summary": {}}
-        except (json.JSONDecodeError) as ex:
+        except (orjson.JSONDecodeError) as ex:
             logging.warning("Log file corrupted. Initializing empty logs.")
             raise ex
     
     def verify_change_in_user_on_this_system_uuid(self):
         url = config.keylogger_service_url.format(HOST=self.host)
-        response = requests.get(url + config.verify_uuid_change.format(uuid=self.uuid))
+        response = self._http.get(url + config.verify_uuid_change.format(uuid=self.uuid), timeout=5)
         if response.status_code != 200:
             self.reset_logs()
         elif response.status_code == 200:
@@ -242,69 +488,155 @@ class ProductivityTracker:
                 self.reset_logs(emp_id)
 
     def reset_logs(self, id=-1):
-        with open("productivity_logs.json", "r+", encoding="utf-8") as f:
-            self.logs = {"emp_id": id, "day_logs": {}, "summary": {}}
-            json.dump(self.logs, f)
+        self.logs = {"emp_id": id, "day_logs": {}, "summary": {}}
+        self.write_logs()
+
+    def write_logs(self):
+        """
+        Write the logs to a temp file and swap it in, so a crash mid-write never truncates the existing logs.
+        """
+        tmp_file = LOG_FILE + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(orjson.dumps(self.logs, option=orjson.OPT_INDENT_2 if self.pretty else None))
+        os.replace(tmp_file, LOG_FILE)
 
     def send_metrics(self, payload):
         url = config.keylogger_service_url.format(HOST=self.host)
-        response = requests.post(url, json=payload, headers=self.headers)
+        body = orjson.dumps(payload)
+        headers = None
+        if config.compress_metrics and len(body) > COMPRESS_THRESHOLD:
+            body = gzip.compress(body, compresslevel=1)
+            headers = {"Content-Encoding": "gzip"}
+        response = self._http.post(url, data=body, headers=headers, timeout=5)
         print("Response persisting in server", response.content)
 
+    def send_worker(self):
+        """
+        Post queued metrics to the server, off the persistence loop so a slow server can't stall saving.
+        """
+        while True:
+            # Metrics are cumulative per day, so of a backlog only the latest payload per date is worth sending
+            payloads = {}
+            payload = self._send_q.get()
+            while True:
+                payloads[payload["date"]] = payload
+                try:
+                    payload = self._send_q.get_nowait()
+                except queue.Empty:
+                    break
+            for payload in payloads.values():
+                try:
+                    self.send_metrics(payload)
+                except Exception as e:
+                    logging.error(f"Error sending metrics: {e}")
+
     def save_logs(self):
+        last_save = None
         while True:
+            # Wake on the base interval so a returning user is saved promptly, only the saves are throttled
+            if last_save is not None and time.monotonic() - last_save < self.log_interval * self._interval_multiplier:
+                time.sleep(self.log_interval)
+                continue
+            last_save = time.monotonic()
+            # The uuid -> employee mapping rarely changes, check it on startup and then hourly.
+            # A failed check waits for the next hour too, so an unreachable server never holds up the save.
+            now = time.monotonic()
+            if self._last_verify is None or now - self._last_verify > VERIFY_INTERVAL:
+                self._last_verify = now
+                try:
+                    self.verify_change_in_user_on_this_system_uuid()
+                except Exception as e:
+                    logging.error(f"Error verifying user for this system: {e}")
             try:
-                self.verify_change_in_user_on_this_system_uuid()
-                with open("productivity_logs.json", "w") as f:
-                    json.dump(self.logs, f, indent=4)
-                    app_activity_filtered_payload = {}
-                    app_activities = self.logs["day_logs"].get(self.today, {}).get("application_activity", None)
-                    if app_activities:
-                        for app_activity in app_activities:
-                            app_activity_filtered_payload.update(
-                                {
-                                    app_activity: {
-                                        "total_key_strokes": app_activities[app_activity]["total_key_strokes"]
-                                    }
+                self.write_logs()
+                app_activity_filtered_payload = {}
+                app_activities = self.logs["day_logs"].get(self.today, {}).get("application_activity", None)
+                if app_activities:
+                    # Copy first, aggregate_logs keeps adding apps to this dict from the tracking thread
+                    for app_activity, activity in dict(app_activities).items():
+                        app_activity_filtered_payload.update(
+                            {
+                                app_activity: {
+                                    "total_key_strokes": activity["total_key_strokes"]
                                 }
-                            )
-                        metrics_payload = {
-                            "uuid": self.uuid,
-                            "date": self.today,
-                            "app_details": app_activity_filtered_payload,
-                            "idle_time": self.logs["day_logs"][self.today]["idle_time"]
-                        }
-                        self.send_metrics(metrics_payload)
+                            }
+                        )
+                    metrics_payload = {
+                        "uuid": self.uuid,
+                        "date": self.today,
+                        "app_details": app_activity_filtered_payload,
+                        "idle_time": self.logs["day_logs"][self.today]["idle_time"]
+                    }
+                    try:
+                        self._send_q.put_nowait(metrics_payload)
+                    except queue.Full:
+                        logging.warning("Metrics queue full, dropping this interval's metrics")
             except Exception as e:
                 logging.error(f"Error saving logs: {e}")
                 traceback.print_exc()
             time.sleep(self.log_interval)
 
-    def count_valid_keystrokes(self, keys, max_idle=20):
-        valid_keys_count = 0
-        consecutive_count = 1  # Start by counting the first key
-        last_key = None
-    
-        for i in range(1, len(keys)):
-            current_key = keys[i]
-    
-            # Check if current key is the same as the previous one
+    def _incremental_count(self, keys, state, max_idle=20):
+        """
+        Continue the valid keystroke count from a previous state using only the newly arrived keys.
+        """
+        last_key, consecutive_count, valid_keys_count = state
+        for current_key in keys:
             if current_key == last_key:
                 consecutive_count += 1
             else:
-                consecutive_count = 1  # Reset if keys differ
-            
-            # If the consecutive count is less than or equal to max_idle, count it
+                consecutive_count = 1
             if consecutive_count <= max_idle:
                 valid_keys_count += 1
-            
-            last_key = current_key  # Update last_key to current one
-        
-        return valid_keys_count
+            last_key = current_key
+        return last_key, consecutive_count, valid_keys_count
 
     @property
     def today(self):
-        return str(datetime.now().date())
+        # Cached until the next midnight
+        expiry, today = self._today_cache
+        if time.time() < expiry:
+            return today
+        now = datetime.now()
+        today = str(now.date())
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        self._today_cache = (midnight.timestamp(), today)
+        return today
+
+    @staticmethod
+    def on_battery():
+        """
+        Platform-specific check whether the system is running on battery power.
+        """
+        if platform.system() != "Windows":
+            return False
+        class SYSTEM_POWER_STATUS(ctypes.Structure):
+            _fields_ = [
+                ("ACLineStatus", ctypes.c_ubyte),
+                ("BatteryFlag", ctypes.c_ubyte),
+                ("BatteryLifePercent", ctypes.c_ubyte),
+                ("SystemStatusFlag", ctypes.c_ubyte),
+                ("BatteryLifeTime", ctypes.c_ulong),
+                ("BatteryFullLifeTime", ctypes.c_ulong),
+            ]
+
+        status = SYSTEM_POWER_STATUS()
+        if not ctypes.windll.kernel32.GetSystemPowerStatus(ctypes.byref(status)):
+            return False
+        return status.ACLineStatus == 0  # 0 = offline, 1 = online, 255 = unknown
+
+    def update_interval_multiplier(self):
+        """
+        Poll less often while nobody is using the system, and less again when on battery.
+        """
+        multiplier = 5 if self.idle_logger.idle else 1
+        try:
+            if self.on_battery():
+                multiplier *= 2
+        except Exception as e:
+            logging.error(f"Error reading power status: {e}")
+        self._interval_multiplier = multiplier
+        return multiplier
 
     def aggregate_logs(self):
         today = self.today
@@ -319,31 +651,34 @@ class ProductivityTracker:
             self.logs["day_logs"][today]["browser_activity"].setdefault(url, {
                 "time_spent": activity.get("time_spent", 0),
                 "visits": activity.get("visits", 0),
-                "keys": [],
-                "total_key_strokes": 0
+                "total_key_strokes": 0,
+                "last_key": None,
+                "consecutive_count": 0
             })
     
         # Update application activity with keys
-        for app, time_spent in self.application_logger.app_time.items():
+        for app, time_spent in self.application_logger.snapshot().items():
             self.logs["day_logs"][today]["application_activity"].setdefault(app, {
                 "time_spent": time_spent,
-                "keys": [],
-                "total_key_strokes": 0
+                "total_key_strokes": 0,
+                "last_key": None,
+                "consecutive_count": 0
             })
     
         # Append keys to their corresponding activity
-        for context, keys in self.keyboard_logger.key_data.items():
-            temp_keys = keys
-            self.keyboard_logger.key_data[context] = self.keyboard_logger.key_data[context][len(temp_keys):]
-            if context in self.logs["day_logs"][today]["browser_activity"]:
-                self.logs["day_logs"][today]["browser_activity"][context]["keys"].extend(temp_keys)
-
-                self.logs["day_logs"][today]["browser_activity"][context]["total_key_strokes"] = self.count_valid_keystrokes(self.logs["day_logs"][today]["browser_activity"][context]["keys"])
-            elif context in self.logs["day_logs"][today]["application_activity"]:
-                self.logs["day_logs"][today]["application_activity"][context]["keys"].extend(temp_keys)
-                self.logs["day_logs"][today]["application_activity"][context]["total_key_strokes"] = self.count_valid_keystrokes(self.logs["day_logs"][today]["application_activity"][context]["keys"])
-
-        self.logs["day_logs"][today]["idle_time"] = self.idle_logger.total_idle_time
+        today_logs = self.logs["day_logs"][today]
+        for context, temp_keys in self.keyboard_logger.swap_key_data().items():
+            activity = today_logs["browser_activity"].get(context) or today_logs["application_activity"].get(context)
+            if not activity:
+                continue
+            # Only the counting state is kept, not the raw keys, so it also survives a restart
+            state = (activity.get("last_key"), activity.get("consecutive_count", 0), activity["total_key_strokes"])
+            last_key, consecutive_count, valid_count = self._incremental_count(temp_keys, state)
+            activity["last_key"] = last_key
+            activity["consecutive_count"] = consecutive_count
+            activity["total_key_strokes"] = valid_count
+
+        today_logs["idle_time"] = self.idle_logger.total_idle_time
 
         # TODO: If needed enable the below.
         # Summary is optional but can include aggregated totals if needed
@@ -356,15 +691,23 @@ class ProductivityTracker:
     def run(self):
         self.threads = [
             threading.Thread(target=self.keyboard_logger.track_keys, daemon=True),
+            threading.Thread(target=self.application_logger.track_foreground, daemon=True),
             threading.Thread(target=self.save_logs, daemon=True),
+            threading.Thread(target=self.send_worker, daemon=True),
         ]
 
         def track_activity():
+            last_update = None
             while True:
-                self.browser_logger.log_browser_activity()
-                self.application_logger.log_active_app()
+                # Idle detection stays on the base interval, it only counts idle time it samples
                 self.idle_logger.check_idle()
-                self.aggregate_logs()
+                self.update_interval_multiplier()
+                now = time.monotonic()
+                if last_update is None or now - last_update >= self.log_interval * self._interval_multiplier:
+                    last_update = now
+                    self.browser_logger.log_browser_activity()
+                    self.application_logger.log_active_app()
+                    self.aggregate_logs()
                 time.sleep(self.log_interval)
 
         self.threads.append(threading.Thread(target=track_activity, daemon=True))
@@ -384,8 +727,9 @@ if __name__ == "__main__":
     host = args.host
     interval = args.interval
     idletime = args.idletime
+    pretty = args.pretty
     if not host:
         sys.exit("Host IP is required")
     print(f"Option provided are\nHost : {host}\nInterval : {interval}\nIdle Time: {idletime}")
-    tracker = ProductivityTracker(host=host, log_interval=interval or 300,idletime=idletime or 120)
+    tracker = ProductivityTracker(host=host, log_interval=interval or 300,idletime=idletime or 120, pretty=pretty)
     tracker.run()